@@ -1,64 +1,246 @@
 # skipbot.py
-import os, json, datetime, random, asyncio
-from threading import Thread
+import os, time, datetime, secrets, asyncio, functools, atexit, logging, signal
+from typing import Optional
 from zoneinfo import ZoneInfo
 
 import discord
+import orjson
+from aiohttp import web
 from discord import ui, app_commands, Interaction, TextStyle
 from discord.ext import commands
-from flask import Flask
-import stripe
+
+log = logging.getLogger("vipbot")
 
 # ---------- CONFIG ----------
 DATA_DIR        = os.getenv("DATA_DIR", "data")
-RSVP_FILE       = os.path.join(DATA_DIR, "vip_rsvps.json")
+RSVP_DIR        = os.path.join(DATA_DIR, "rsvps")
+OLD_RSVP_FILE   = os.path.join(DATA_DIR, "vip_rsvps.json")
 DISCORD_TOKEN   = os.getenv("DISCORD_TOKEN")
-STRIPE_API_KEY  = os.getenv("STRIPE_API_KEY")
 GUILD_ID        = int(os.getenv("GUILD_ID"))
 VIP_CHANNEL_ID  = int(os.getenv("VIP_CHANNEL_ID"))
 GUILD           = discord.Object(id=GUILD_ID)
 
-stripe.api_key  = STRIPE_API_KEY
-
 # ---------- STORAGE HELPERS ----------
 def ensure_data_dir():
-    os.makedirs(DATA_DIR, exist_ok=True)
-
-def load_rsvps() -> dict:
-    ensure_data_dir()
-    if not os.path.exists(RSVP_FILE):
-        return {}
-    with open(RSVP_FILE, "r") as f:
-        return json.load(f)
-
-def save_rsvps(data: dict):
+    os.makedirs(RSVP_DIR, exist_ok=True)
+
+def rsvp_path(day: str) -> str:
+    # one file per sale night, so a write only ever serializes that night
+    return os.path.join(RSVP_DIR, f"{day}.json")
+
+# parsed file contents keyed by path -> (st_mtime_ns, data), plus the
+# raw bytes last read/written so unchanged saves can be skipped
+_JSON_CACHE: dict[str, tuple[int, list]] = {}
+_JSON_BYTES: dict[str, bytes] = {}
+
+def load_rsvps(day: str) -> list:
+    path = rsvp_path(day)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return _JSON_CACHE.setdefault(path, (0, []))[1]
+    cached = _JSON_CACHE.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with open(path, "rb") as f:
+        raw = f.read()
+    data = orjson.loads(raw)
+    _JSON_CACHE[path] = (mtime, data)
+    _JSON_BYTES[path] = raw
+    _RSVP_INDEX.pop(day, None)
+    return data
+
+def save_rsvps(day: str, data: list):
+    path = rsvp_path(day)
+    raw  = orjson.dumps(data)
+    if raw == _JSON_BYTES.get(path):
+        return
     ensure_data_dir()
-    with open(RSVP_FILE, "w") as f:
-        json.dump(data, f, indent=2)
-
-def add_rsvp(entry: dict):
-    data = load_rsvps()
-    key  = get_sale_date()
-    day  = data.setdefault(key, [])
-    day.append(entry)
-    save_rsvps(data)
+    # write a sibling temp file and swap it in so readers never see a
+    # half-written file
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(raw)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    _JSON_BYTES[path] = raw
+    _JSON_CACHE[path] = (os.stat(path).st_mtime_ns, data)
+
+def evict_other_days(keep: str):
+    # only tonight's list needs to stay in memory
+    for day in [d for d in _RSVP_INDEX if d != keep]:
+        del _RSVP_INDEX[day]
+    keep_path = rsvp_path(keep)
+    for path in [p for p in _JSON_CACHE if p != keep_path]:
+        del _JSON_CACHE[path]
+        _JSON_BYTES.pop(path, None)
+
+def migrate_legacy_rsvps():
+    # split the old single vip_rsvps.json ({day: [entries]}) into
+    # per-night files, then move it aside so this only runs once
+    if not os.path.exists(OLD_RSVP_FILE):
+        return
+    with open(OLD_RSVP_FILE, "rb") as f:
+        legacy = orjson.loads(f.read())
+    for day, entries in legacy.items():
+        if not os.path.exists(rsvp_path(day)):
+            save_rsvps(day, entries)
+    os.replace(OLD_RSVP_FILE, OLD_RSVP_FILE + ".migrated")
+    evict_other_days(get_sale_date())
+
+# per-day lookup sets (user ids, 4-digit membership #s) so duplicate
+# checks are O(1) instead of scanning the day's list
+_RSVP_INDEX: dict[str, tuple[set[int], set[str]]] = {}
+
+def rsvp_index(day: str) -> tuple[set[int], set[str]]:
+    index = _RSVP_INDEX.get(day)
+    if index is None:
+        entries = load_rsvps(day)
+        index   = _RSVP_INDEX[day] = (
+            {r["user_id"] for r in entries},
+            {r["id_or_dob"] for r in entries if len(r["id_or_dob"]) == 4},
+        )
+    return index
+
+# writes are coalesced: add_rsvp mutates the cached list and a single
+# flush runs FLUSH_DELAY seconds after the first unsaved change; a failed
+# save is retried after FLUSH_RETRY_DELAY
+FLUSH_DELAY       = 0.5
+FLUSH_RETRY_DELAY = 5
+_rsvp_lock    = asyncio.Lock()
+_dirty_days: set[str] = set()
+_flush_handle = None
+_flush_tasks: set[asyncio.Task] = set()  # strong refs until each finishes
+
+def schedule_flush(delay: float = FLUSH_DELAY):
+    global _flush_handle
+    if _flush_handle is None:
+        _flush_handle = asyncio.get_running_loop().call_later(delay, _start_flush)
+
+def _start_flush():
+    task = asyncio.create_task(flush_rsvps())
+    _flush_tasks.add(task)
+    task.add_done_callback(_flush_tasks.discard)
+
+async def add_rsvp(entry: dict) -> Optional[str]:
+    # returns None once added, or which check failed: "user" if this user
+    # already RSVPed tonight, "member" if the membership # was already used
+    async with _rsvp_lock:
+        day = get_sale_date()
+        users, members = rsvp_index(day)
+        member = entry["id_or_dob"] if len(entry["id_or_dob"]) == 4 else None
+        if entry["user_id"] in users:
+            return "user"
+        if member in members:
+            return "member"
+        load_rsvps(day).append(entry)
+        users.add(entry["user_id"])
+        if member:
+            members.add(member)
+        _dirty_days.add(day)
+    schedule_flush()
+    return None
+
+async def flush_rsvps():
+    global _flush_handle
+    async with _rsvp_lock:
+        if _flush_handle is not None:
+            _flush_handle.cancel()
+            _flush_handle = None
+        for day in sorted(_dirty_days):
+            try:
+                # serialize + write off the event loop; add_rsvp waits on the lock
+                await asyncio.to_thread(save_rsvps, day, load_rsvps(day))
+            except Exception:
+                log.exception("Saving RSVPs for %s failed; retrying in %ss",
+                              day, FLUSH_RETRY_DELAY)
+                continue
+            _dirty_days.discard(day)
+        if _dirty_days:
+            # unsaved days must stay cached until a retry succeeds
+            schedule_flush(FLUSH_RETRY_DELAY)
+        else:
+            evict_other_days(get_sale_date())
+
+@atexit.register
+def _flush_on_exit():
+    # VIPBot.close() flushes on a normal shutdown (incl. SIGTERM/Ctrl-C);
+    # this is the last resort if that flush failed or close() never ran
+    for day in _dirty_days:
+        save_rsvps(day, load_rsvps(day))
 
 def get_todays_rsvps() -> list:
-    return load_rsvps().get(get_sale_date(), [])
+    return load_rsvps(get_sale_date())
 
 # ---------- DATE HELPERS ----------
+NY_TZ   = ZoneInfo("America/New_York")
+ONE_DAY = datetime.timedelta(days=1)
+
+# (monotonic expiry, sale date) of the last computation; reused for up to
+# SALE_DATE_TTL seconds but never past the next 1am rollover
+SALE_DATE_TTL = 30
+ROLLOVER      = datetime.time(1)
+_sale_date    = (float("-inf"), "")
+
 def get_sale_date() -> str:
-    now = datetime.datetime.now(ZoneInfo("America/New_York"))
+    global _sale_date
+    t = time.monotonic()
+    if t < _sale_date[0]:
+        return _sale_date[1]
+    now = datetime.datetime.now(NY_TZ)
     if now.hour < 1:
-        now -= datetime.timedelta(days=1)
-    return now.date().isoformat()
-
+        day, next_day = now.date() - ONE_DAY, now.date()
+    else:
+        day, next_day = now.date(), now.date() + ONE_DAY
+    # compare via timestamps so a DST change before the boundary counts
+    rollover = datetime.datetime.combine(next_day, ROLLOVER, tzinfo=NY_TZ)
+    ttl = min(SALE_DATE_TTL, rollover.timestamp() - now.timestamp())
+    _sale_date = (t + ttl, day.isoformat())
+    return _sale_date[1]
+
+WEEKDAYS = ("Monday", "Tuesday", "Wednesday", "Thursday",
+            "Friday", "Saturday", "Sunday")
+MONTHS   = ("January", "February", "March", "April", "May", "June", "July",
+            "August", "September", "October", "November", "December")
+
+@functools.lru_cache(maxsize=64)
 def human_date(iso: str) -> str:
-    return datetime.date.fromisoformat(iso).strftime("%A, %B %-d, %Y")
+    # same output as strftime("%A, %B %-d, %Y") without the locale path
+    # (and without relying on glibc's %-d)
+    d = datetime.date.fromisoformat(iso)
+    return f"{WEEKDAYS[d.weekday()]}, {MONTHS[d.month - 1]} {d.day}, {d.year}"
+
+# ---------- ROLE HELPERS ----------
+def has_role(member: discord.Member, name: str) -> bool:
+    return any(r.name == name for r in member.roles)
 
 # ---------- RSVP MODAL ----------
+# rejection messages keyed by the conflict add_rsvp reports
+CONFLICT_MESSAGES = {
+    "user":   "❌ You’ve already RSVPed for tonight.",
+    "member": "❌ That membership # has already been used tonight.",
+}
+
+CODE_ALPHABET = "ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+
+# static ticket layout; only the per-member fields are filled in per send
+TICKET_TEMPLATE = (
+    "🎟 **VIP RSVP Ticket**\n"
+    "Member: {name}\n"
+    "Last Name: {last_name}\n"
+    "Membership #: {member}\n"
+    "DOB: {dob}\n"
+    "Valid Date: {date}\n"
+    "Code: `{code}`"
+)
+
 class RSVPModal(ui.Modal, title="VIP RSVP"):
-    last_name = ui.TextInput(label="Last name on your ID", style=TextStyle.short)
+    last_name = ui.TextInput(
+        label="Last name on your ID",
+        style=TextStyle.short,
+        max_length=64
+    )
     id_or_dob = ui.TextInput(
         label="Membership Number (4 digits) or DOB (MMDDYY)",
         style=TextStyle.short,
@@ -76,25 +258,24 @@ class RSVPModal(ui.Modal, title="VIP RSVP"):
             return
 
         # 2) Prevent multiple RSVPs per user
-        todays = get_todays_rsvps()
-        if any(r["user_id"] == inter.user.id for r in todays):
+        users, members = rsvp_index(get_sale_date())
+        if inter.user.id in users:
             await inter.response.send_message(
-                "❌ You’ve already RSVPed for tonight.", ephemeral=True
+                CONFLICT_MESSAGES["user"], ephemeral=True
             )
             return
 
         # 3) Prevent reusing the same membership # (only 4-digit keys)
-        if len(key)==4 and any(r["id_or_dob"] == key for r in todays):
+        if len(key)==4 and key in members:
             await inter.response.send_message(
-                "❌ That membership # has already been used tonight.", ephemeral=True
+                CONFLICT_MESSAGES["member"], ephemeral=True
             )
             return
 
         # 4) All good → generate code, save & send ticket
-        code = "-".join(
-            "".join(random.choices("ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789", k=3))
-            for _ in range(3)
-        )
+        # codes gate club entry, so draw them from secrets, not random
+        c    = "".join(secrets.choice(CODE_ALPHABET) for _ in range(9))
+        code = f"{c[:3]}-{c[3:6]}-{c[6:]}"
         human = human_date(get_sale_date())
         entry = {
             "user_id":   inter.user.id,
@@ -103,20 +284,25 @@ class RSVPModal(ui.Modal, title="VIP RSVP"):
             "id_or_dob": key,
             "code":      code
         }
-        add_rsvp(entry)
+        conflict = await add_rsvp(entry)
+        if conflict:
+            # lost a race with a concurrent submit for the same user / #
+            await inter.response.send_message(
+                CONFLICT_MESSAGES[conflict], ephemeral=True
+            )
+            return
 
         await inter.response.send_message(
             "✅ RSVP received! Check your DMs for your ticket.", ephemeral=True
         )
-        await inter.user.send(
-            f"🎟 **VIP RSVP Ticket**\n"
-            f"Member: {inter.user.display_name}\n"
-            f"Last Name: {self.last_name.value.strip()}\n"
-            f"Membership #: {key if len(key)==4 else '—'}\n"
-            f"DOB: {key if len(key)==6 else '—'}\n"
-            f"Valid Date: {human}\n"
-            f"Code: `{code}`"
-        )
+        await inter.user.send(TICKET_TEMPLATE.format(
+            name=entry["name"],
+            last_name=entry["last_name"],
+            member=key if len(key)==4 else "—",
+            dob=key if len(key)==6 else "—",
+            date=human,
+            code=code,
+        ))
 
 # ---------- BUTTON VIEW ----------
 class RSVPButtonView(ui.View):
@@ -130,19 +316,21 @@ class RSVPButtonView(ui.View):
     )
     async def rsvp_button(self, interaction: Interaction, button: ui.Button):
         # ensure VIP role
-        if "VIP" not in [r.name for r in interaction.user.roles]:
+        if not has_role(interaction.user, "VIP"):
             return await interaction.response.send_message(
                 "⛔ VIPs only.", ephemeral=True
             )
 
-        # open the modal
+        # open the modal; repeat RSVPs are rejected in on_submit, so no
+        # extra message edit is needed here
         await interaction.response.send_modal(RSVPModal())
 
-        # disable **this button instance** so the same user can't click it again
-        button.disabled = True
-        await interaction.message.edit(view=self)
-
 # ---------- STAFF COG ----------
+RSVP_LINE = (
+    "{i:2d}. {name} — Last: {last_name} "
+    "— Membership #: {id_or_dob} — Code: `{code}`"
+).format
+
 class StaffCommands(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
@@ -155,58 +343,118 @@ class StaffCommands(commands.Cog):
     async def list_rsvps(self, inter: Interaction):
         # only staff or owner
         if not (inter.user.guild_permissions.manage_guild or
-                "Staff" in [r.name for r in inter.user.roles]):
+                has_role(inter.user, "Staff")):
             return await inter.response.send_message(
                 "⛔ Staff only.", ephemeral=True
             )
 
+        # ack within Discord's 3s window before touching storage
+        await inter.response.defer(ephemeral=True)
+
         entries = get_todays_rsvps()
         if not entries:
-            return await inter.response.send_message("No RSVPs yet.", ephemeral=True)
+            return await inter.followup.send("No RSVPs yet.", ephemeral=True)
 
         lines = [f"**VIP RSVPs for {human_date(get_sale_date())}**"]
         for i,e in enumerate(entries, start=1):
-            lines.append(
-                f"{i:2d}. {e['name']} — Last: {e['last_name']} "
-                f"— Membership #: {e['id_or_dob']} — Code: `{e['code']}`"
-            )
-
-        text = "\n".join(lines)
-        for chunk in [text[i:i+1900] for i in range(0, len(text), 1900)]:
-            await inter.response.send_message(chunk, ephemeral=True)
-
-# ---------- FLASK HEALTH CHECK ----------
-app = Flask(__name__)
-@app.route("/", methods=["GET","HEAD"])
-def health():
-    return "VIPBot OK", 200
+            lines.append(RSVP_LINE(i=i, **e))
+
+        # send in <=1900-char messages, breaking between lines; a single
+        # line longer than that is hard-split so no message can exceed it
+        chunk, size = [], 0
+        for line in lines:
+            for piece in (line[i:i+1900] for i in range(0, len(line), 1900)):
+                if chunk and size + len(piece) + 1 > 1900:
+                    await inter.followup.send("\n".join(chunk), ephemeral=True)
+                    chunk, size = [], 0
+                chunk.append(piece)
+                size += len(piece) + 1
+        await inter.followup.send("\n".join(chunk), ephemeral=True)
+
+# ---------- HEALTH CHECK ----------
+HEALTH_BODY = b"VIPBot OK"
+
+async def health(request: web.Request) -> web.Response:
+    # aiohttp responses can't be re-sent, so share the pre-encoded body
+    return web.Response(body=HEALTH_BODY, content_type="text/plain")
+
+web_app = web.Application()
+web_app.router.add_get("/", health)  # also answers HEAD
+web_runner = None
+
+async def start_web():
+    # serve on the bot's own event loop instead of a Flask thread
+    global web_runner
+    web_runner = web.AppRunner(web_app)
+    await web_runner.setup()
+    await web.TCPSite(web_runner, "0.0.0.0", 8080).start()
 
 # ---------- BOT SETUP ----------
+class VIPBot(commands.Bot):
+    async def setup_hook(self):
+        # runs once per process, before the gateway connects (unlike
+        # on_ready, which re-fires on every reconnect)
+        global rsvp_view
+
+        # start health-check server
+        await start_web()
+
+        # install the persistent view
+        rsvp_view = RSVPButtonView()
+        self.add_view(rsvp_view)
+
+        # add the staff cog and sync only to your guild
+        await self.add_cog(StaffCommands(self))
+        await self.tree.sync(guild=GUILD)
+
+        # docker stop / systemd / PaaS restarts send SIGTERM, which would
+        # kill the process without running close(); turn it into a clean
+        # shutdown so pending RSVPs get flushed
+        try:
+            asyncio.get_running_loop().add_signal_handler(
+                signal.SIGTERM, self._on_sigterm
+            )
+        except NotImplementedError:  # no signal handlers on Windows loops
+            pass
+
+    def _on_sigterm(self):
+        # keep a reference so the close task can't be collected mid-run
+        self._close_task = asyncio.create_task(self.close())
+
+    async def close(self):
+        # write RSVPs still waiting on the debounce before disconnecting
+        global web_runner
+        await flush_rsvps()
+        if web_runner is not None:
+            await web_runner.cleanup()
+            web_runner = None
+        await super().close()
+
 intents = discord.Intents.default()
 intents.members = True
-bot = commands.Bot(command_prefix="!", intents=intents)
+bot = VIPBot(command_prefix="!", intents=intents)
+
+# single persistent RSVP view, built in setup_hook (views need a running loop)
+rsvp_view     = None
+button_posted = False
 
 @bot.event
 async def on_ready():
-    # start health-check server
-    Thread(target=lambda: app.run(host="0.0.0.0", port=8080), daemon=True).start()
-
-    # install the view and post the button
-    view  = RSVPButtonView()
-    bot.add_view(view)
-    vip_ch = bot.get_channel(VIP_CHANNEL_ID)
-    if vip_ch:
-        await vip_ch.send(
-            "🎉 **VIP RSVP for tonight**\nClick below to get your ticket:",
-            view=view
-        )
-
-    # add the staff cog and sync only to your guild
-    await bot.add_cog(StaffCommands(bot))
-    await bot.tree.sync(guild=GUILD)
+    # post the button once; the flag is only set after the send succeeds
+    # so a failed post is retried on the next reconnect
+    global button_posted
+    if not button_posted:
+        vip_ch = bot.get_channel(VIP_CHANNEL_ID)
+        if vip_ch:
+            await vip_ch.send(
+                "🎉 **VIP RSVP for tonight**\nClick below to get your ticket:",
+                view=rsvp_view
+            )
+            button_posted = True
 
     print(f"✅ VIPBot ready as {bot.user}")
 
 if not DISCORD_TOKEN:
     raise RuntimeError("Missing DISCORD_TOKEN")
+migrate_legacy_rsvps()
 bot.run(DISCORD_TOKEN)